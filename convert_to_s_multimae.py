@@ -17,14 +17,12 @@ def main(args: PretrainArgparser):
     print("Load artifacts from", artifacts_path)
     artifacts = torch.load(artifacts_path, map_location="cpu")
 
-    rs = OrderedDict()
-    for k, v in artifacts["state_dict"].items():
-        k: str
-        v: Tensor
-        if k.startswith("model.output_adapters."):  # skip 'output_adapters.*'
-            continue
-        if k.startswith("model."):
-            rs[k[6:]] = v
+    # Keep the 'model.*' weights without the 'model.' prefix, skip 'output_adapters.*'
+    rs: OrderedDict[str, Tensor] = OrderedDict(
+        (k[len("model.") :], v)
+        for k, v in artifacts["state_dict"].items()
+        if k.startswith("model.") and not k.startswith("model.output_adapters.")
+    )
 
     exported_model_path = os.path.join(args.output_dir, f"multimae_{args.version}.pth")
     print("Exported model path:", exported_model_path)
@@ -1,6 +1,9 @@
 from typing import Dict, Type
+import torch
+from torch import nn
 from multimae.criterion import MaskedL1Loss, MaskedMSELoss
 from multimae.input_adapters import PatchedInputAdapter
+from multimae.multimae_utils import FusedLayerNorm, compile_forward
 from multimae.output_adapters import SpatialOutputAdapter
 from functools import partial
 from pretrain_argparser import PretrainArgparser
@@ -26,6 +29,19 @@ DOMAIN_CONF = {
 }
 
 
+def get_encoder_kwargs(args: PretrainArgparser) -> Dict:
+    """Encoder layer arguments shared by get_model and the exported MultiViT"""
+    kwargs = dict(
+        act_layer=partial(nn.GELU, approximate="tanh") if args.tanh_gelu else nn.GELU,
+    )
+    if args.fused_layer_norm:
+        assert (
+            FusedLayerNorm is not None
+        ), "fused_layer_norm requires apex built with its CUDA extensions"
+        kwargs["norm_layer"] = partial(FusedLayerNorm, eps=1e-6)
+    return kwargs
+
+
 def get_model(args: PretrainArgparser) -> MultiMAE:
     """Creates and returns model from arguments"""
     print(
@@ -78,6 +94,16 @@ def get_model(args: PretrainArgparser) -> MultiMAE:
         output_adapters=output_adapters,
         num_global_tokens=args.num_global_tokens,
         drop_path_rate=args.drop_path,
+        compile_encoder=args.compile_encoder,
+        use_checkpoint=args.use_checkpoint,
+        encoder_amp_dtype=(
+            getattr(torch, args.encoder_amp_dtype) if args.encoder_amp_dtype else None
+        ),
+        **get_encoder_kwargs(args),
     )
 
+    if args.compile_model:
+        # Compile forward only, so that state dict keys (and checkpoints) stay unchanged
+        compile_forward(model, mode=args.compile_mode, fullgraph=False, dynamic=False)
+
     return model
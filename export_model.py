@@ -0,0 +1,256 @@
+import copy
+import os
+import subprocess
+import time
+from typing import Dict, List, Tuple
+
+import torch
+from torch import Tensor, nn
+
+from domain_conf import DOMAIN_CONF, get_encoder_kwargs
+from multimae import MultiViT
+from pretrain_argparser import PretrainArgparser, get_args
+from utils.cuda_graph import MultiViTCudaGraphRunner
+from utils.model_builder import create_model
+
+
+class PositionalInputs(nn.Module):
+    """Wraps a MultiViT so that it takes one tensor per domain as positional inputs,
+    which is what torch.onnx.export and TensorRT bindings expect."""
+
+    def __init__(self, model: MultiViT, domains: List[str]):
+        super().__init__()
+        self.model = model
+        self.domains = domains
+
+    def forward(self, *xs: Tensor) -> Tensor:
+        return self.model(dict(zip(self.domains, xs)))
+
+
+def get_multivit(args: PretrainArgparser) -> MultiViT:
+    """Creates the MultiViT encoder (no output adapters) matching the pretrained model"""
+    input_adapters = {
+        domain: DOMAIN_CONF[domain]["input_adapter"](
+            stride_level=DOMAIN_CONF[domain]["stride_level"],
+            patch_size_full=args.input_patch_size,
+            image_size=args.input_size,
+        )
+        for domain in args.in_domains
+    }
+    return create_model(
+        args.model.replace("pretrain_multimae", "multivit"),
+        input_adapters=input_adapters,
+        output_adapters=None,
+        num_global_tokens=args.num_global_tokens,
+        **get_encoder_kwargs(args),
+    )
+
+
+def export_onnx(
+    model: nn.Module, inputs: Dict[str, Tensor], onnx_path: str, opset_version: int = 17
+) -> None:
+    """Exports the model with static input shapes, one named ONNX input per domain"""
+    domains = list(inputs.keys())
+    torch.onnx.export(
+        PositionalInputs(model, domains).eval(),
+        tuple(inputs.values()),
+        onnx_path,
+        opset_version=opset_version,
+        input_names=domains,
+        output_names=["encoder_tokens"],
+        dynamic_axes=None,
+    )
+
+
+def build_trt_engine(
+    onnx_path: str, engine_path: str, extra_flags: Tuple[str, ...] = ("--fp16",)
+) -> None:
+    """Builds a TensorRT engine from an ONNX model with trtexec"""
+    subprocess.run(
+        [
+            "trtexec",
+            f"--onnx={onnx_path}",
+            f"--saveEngine={engine_path}",
+            "--builderOptimizationLevel=5",
+            *extra_flags,
+        ],
+        check=True,
+    )
+
+
+def quantize_fp8(model: nn.Module, calib_inputs: List[Dict[str, Tensor]]) -> nn.Module:
+    """
+    FP8 post-training quantization of the encoder attention / MLP Linears with NVIDIA ModelOpt.
+    Patch embeddings of the input adapters are kept in full precision.
+
+    :param model: MultiViT on CUDA, in eval mode
+    :param calib_inputs: Input dictionaries used to calibrate the activation scales
+    """
+    import modelopt.torch.quantization as mtq
+
+    config = copy.deepcopy(mtq.FP8_DEFAULT_CFG)
+    config["quant_cfg"]["*input_adapters*"] = {"enable": False}
+
+    def forward_loop(m: nn.Module):
+        with torch.no_grad():
+            for x in calib_inputs:
+                m({domain: t.cuda() for domain, t in x.items()})
+
+    return mtq.quantize(model, config, forward_loop=forward_loop)
+
+
+def get_calib_inputs(args: PretrainArgparser) -> List[Dict[str, Tensor]]:
+    """Validation samples used to calibrate FP8 activation scales"""
+    from run_pretraining_multimae_v2 import MDataset
+
+    dataset = MDataset(
+        args,
+        args.input_size,
+        args.data_path,
+        split="validation",
+        max_samples=args.num_calib_samples,
+    )
+    return [
+        {"rgb": image.unsqueeze(0), "depth": depth.unsqueeze(0)}
+        for image, depth in dataset
+    ]
+
+
+def optimize_onnx_for_cpu(
+    onnx_path: str, optimized_path: str, num_heads: int, hidden_size: int
+) -> None:
+    """Fuses attention and residual + LayerNorm subgraphs with the ONNX Runtime
+    transformers optimizer, for CPU inference"""
+    from onnxruntime.transformers import optimizer
+
+    optimized_model = optimizer.optimize_model(
+        onnx_path,
+        model_type="vit",
+        num_heads=num_heads,
+        hidden_size=hidden_size,
+        opt_level=2,
+        use_gpu=False,
+    )
+    optimized_model.save_model_to_file(optimized_path)
+
+
+class ORTRunner:
+    """Runs an ONNX model with ONNX Runtime on CPU"""
+
+    def __init__(self, onnx_path: str):
+        import onnxruntime as ort
+
+        self.session = ort.InferenceSession(
+            onnx_path, providers=["CPUExecutionProvider"]
+        )
+
+    def __call__(self, inputs: Dict[str, Tensor]) -> Dict[str, Tensor]:
+        output_names = [o.name for o in self.session.get_outputs()]
+        outputs = self.session.run(
+            output_names,
+            {domain: t.detach().cpu().numpy() for domain, t in inputs.items()},
+        )
+        return {name: torch.from_numpy(o) for name, o in zip(output_names, outputs)}
+
+
+class TRTRunner:
+    """Runs a serialized TensorRT engine on CUDA torch tensors"""
+
+    def __init__(self, engine_path: str):
+        import tensorrt as trt
+
+        self.trt = trt
+        logger = trt.Logger(trt.Logger.WARNING)
+        with open(engine_path, "rb") as f, trt.Runtime(logger) as runtime:
+            self.engine = runtime.deserialize_cuda_engine(f.read())
+        self.context = self.engine.create_execution_context()
+        self.dtypes = {
+            trt.float32: torch.float32,
+            trt.float16: torch.float16,
+            trt.int32: torch.int32,
+            trt.bool: torch.bool,
+        }
+
+    def __call__(self, inputs: Dict[str, Tensor]) -> Dict[str, Tensor]:
+        # Keep references to the input tensors until the engine has run
+        bound_inputs, outputs = [], {}
+        for i in range(self.engine.num_io_tensors):
+            name = self.engine.get_tensor_name(i)
+            dtype = self.dtypes[self.engine.get_tensor_dtype(name)]
+            if self.engine.get_tensor_mode(name) == self.trt.TensorIOMode.INPUT:
+                tensor = inputs[name].to(device="cuda", dtype=dtype).contiguous()
+                bound_inputs.append(tensor)
+            else:
+                shape = tuple(self.context.get_tensor_shape(name))
+                tensor = torch.empty(shape, dtype=dtype, device="cuda")
+                outputs[name] = tensor
+            self.context.set_tensor_address(name, tensor.data_ptr())
+        self.context.execute_async_v3(torch.cuda.current_stream().cuda_stream)
+        return outputs
+
+
+def main(args: PretrainArgparser):
+    model = get_multivit(args).eval()
+
+    # Encoder weights exported by convert_to_s_multimae.py
+    weights_path = os.path.join(args.output_dir, f"multimae_{args.version}.pth")
+    if os.path.isfile(weights_path):
+        print("Load weights from", weights_path)
+        checkpoint = torch.load(weights_path, map_location="cpu")["model"]
+        model.load_state_dict(checkpoint, strict=False)
+    else:
+        print(f"{weights_path} not found, exporting randomly initialized weights")
+
+    inputs = {
+        domain: torch.zeros(
+            1, DOMAIN_CONF[domain]["channels"], args.input_size, args.input_size
+        )
+        for domain in args.in_domains
+    }
+
+    if args.use_cuda_graph:
+        runner = MultiViTCudaGraphRunner(copy.deepcopy(model).cuda())
+        cuda_inputs = {domain: t.cuda() for domain, t in inputs.items()}
+        runner(cuda_inputs)  # Warmup + capture
+        torch.cuda.synchronize()
+        start = time.time()
+        runner(cuda_inputs)
+        torch.cuda.synchronize()
+        print(f"CUDA graph forward pass: {time.time() - start:.4f}s")
+
+    trt_flags = ("--fp16",)
+    if args.quantize_fp8:
+        # Quantized models are exported with FP8 Q/DQ nodes, so they need to be on CUDA
+        model = quantize_fp8(model.cuda(), get_calib_inputs(args))
+        inputs = {domain: t.cuda() for domain, t in inputs.items()}
+        trt_flags = ("--fp16", "--fp8")
+
+    onnx_path = os.path.join(args.output_dir, f"multimae_{args.version}.onnx")
+    print("Exported ONNX path:", onnx_path)
+    export_onnx(model, inputs, onnx_path)
+
+    if args.use_ort:
+        ort_path = os.path.join(args.output_dir, f"multimae_{args.version}_ort.onnx")
+        print("Optimized ONNX Runtime model path:", ort_path)
+        optimize_onnx_for_cpu(
+            onnx_path,
+            ort_path,
+            num_heads=model.encoder[0].attn.num_heads,
+            hidden_size=model.global_tokens.shape[-1],
+        )
+        outputs = ORTRunner(ort_path)(inputs)
+        print({name: tuple(t.shape) for name, t in outputs.items()})
+
+    engine_path = os.path.join(args.output_dir, f"multimae_{args.version}.plan")
+    if args.export_trt:
+        print("Exported TensorRT engine path:", engine_path)
+        build_trt_engine(onnx_path, engine_path, extra_flags=trt_flags)
+
+    if args.use_trt:
+        outputs = TRTRunner(engine_path)(inputs)
+        torch.cuda.synchronize()
+        print({name: tuple(t.shape) for name, t in outputs.items()})
+
+
+if __name__ == "__main__":
+    main(get_args())
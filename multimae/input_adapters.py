@@ -19,11 +19,30 @@ from typing import Optional, Tuple, Union
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-from einops import rearrange, repeat
+from torch import Tensor
 
 from .multimae_utils import build_2d_sincos_posemb, pair, trunc_normal_
 
 
+def patchify(x: Tensor, P_H: int, P_W: int) -> Tensor:
+    """
+    Creates patches [B, C, H, W] -> [B, (N_H*N_W), (C*P_H*P_W)], flattened in the same
+    (c, ph, pw) order as a Conv2d weight. Input sizes not divisible by the patch size
+    make the reshape fail.
+
+    :param x: Input image tensor
+    :param P_H: Patch height
+    :param P_W: Patch width
+    """
+    B, C, H, W = x.shape
+    N_H, N_W = H // P_H, W // P_W  # Number of patches in height and width
+    return (
+        x.reshape(B, C, N_H, P_H, N_W, P_W)
+        .permute(0, 2, 4, 1, 3, 5)
+        .reshape(B, N_H * N_W, C * P_H * P_W)
+    )
+
+
 class PatchedInputAdapter(nn.Module):
     """Adapter for spatial inputs, like images or feature maps.
     Creates tokens from patches over the image.
@@ -76,6 +95,11 @@ class PatchedInputAdapter(nn.Module):
         :param dim_tokens: Dimension of tokens
         """
         self.dim_tokens = dim_tokens
+        H = self.image_size[0] // self.stride_level
+        W = self.image_size[1] // self.stride_level
+        assert (H % self.P_H == 0) and (
+            W % self.P_W == 0
+        ), f"Image sizes {H}x{W} must be divisible by patch sizes {self.P_H}x{self.P_W}"
 
         # Task embedding identifying from which task a given token comes from
         # Fixed-size positional embeddings. Can be interpolated to different input sizes
@@ -94,7 +118,8 @@ class PatchedInputAdapter(nn.Module):
             )
             trunc_normal_(self.pos_emb, std=0.02)
 
-        # Image -> tokens projection
+        # Image -> tokens projection. Kept as a Conv2d for checkpoint compatibility,
+        # but applied as a Linear over flattened patches in forward
         self.proj = nn.Conv2d(
             in_channels=self.num_channels,
             out_channels=self.dim_tokens,
@@ -102,10 +127,56 @@ class PatchedInputAdapter(nn.Module):
             stride=(self.P_H, self.P_W),
         )
 
+        # Fixed positional embeddings resized to the current patch grid, as tokens [1, N, D].
+        # Non-persistent, so that it follows device moves but is not stored in checkpoints.
+        self.register_buffer("pos_emb_resolved", None, persistent=False)
+        # (N_H, N_W, pos_emb version) that pos_emb_resolved was computed for
+        self._pos_emb_resolved_key: Optional[Tuple[int, int, int]] = None
+        if not self.pos_emb.requires_grad:
+            # Resolve for the configured image size upfront, so that inputs of that size
+            # never build positional embeddings at forward time
+            self.get_pos_emb(h_posemb, w_posemb)
+
     @torch.jit.ignore
     def no_weight_decay(self):
         return {"pos_emb"}
 
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        # Also accept patch embeddings stored as a Linear weight [D, C*P_H*P_W]
+        proj_key = prefix + "proj.weight"
+        weight = state_dict.get(proj_key, None)
+        if self.dim_tokens is not None and weight is not None and weight.dim() == 2:
+            state_dict[proj_key] = weight.reshape(self.proj.weight.shape)
+        super()._load_from_state_dict(state_dict, prefix, *args, **kwargs)
+
+    def _resize_pos_emb(self, N_H: int, N_W: int) -> Tensor:
+        x_pos_emb = self.pos_emb
+        # Bicubic interpolation to the same size is the identity
+        if (N_H, N_W) != tuple(x_pos_emb.shape[-2:]):
+            x_pos_emb = F.interpolate(
+                x_pos_emb, size=(N_H, N_W), mode="bicubic", align_corners=False
+            )
+        return x_pos_emb.flatten(2).transpose(1, 2)  # b d nh nw -> b (nh nw) d
+
+    def get_pos_emb(self, N_H: int, N_W: int) -> Tensor:
+        """
+        Returns positional embeddings for a N_H x N_W patch grid as tokens [1, N_H*N_W, D].
+        Fixed embeddings are only resized when the grid size changes.
+
+        :param N_H: Number of patches in height
+        :param N_W: Number of patches in width
+        """
+        if self.pos_emb.requires_grad:
+            # Learnable embeddings need to be resized every step to get gradients
+            return self._resize_pos_emb(N_H, N_W)
+
+        # pos_emb version is bumped by load_state_dict and in-place updates
+        key = (N_H, N_W, self.pos_emb._version)
+        if self._pos_emb_resolved_key != key:
+            self.pos_emb_resolved = self._resize_pos_emb(N_H, N_W)
+            self._pos_emb_resolved_key = key
+        return self.pos_emb_resolved
+
     def forward(self, x):
         """
         Forward pass through input adapter, transforming image to sequence of tokens.
@@ -113,23 +184,15 @@ class PatchedInputAdapter(nn.Module):
 
         :param x: Input image tensor
         """
-        B, C, H, W = x.shape
-        assert (
-            self.dim_tokens is not None
-        ), "Need to call init(dim_tokens) function first"
-        assert (H % self.P_H == 0) and (
-            W % self.P_W == 0
-        ), f"Image sizes {H}x{W} must be divisible by patch sizes {self.P_H}x{self.P_W}"
-        N_H, N_W = H // self.P_H, W // self.P_W  # Number of patches in height and width
+        N_H, N_W = x.shape[2] // self.P_H, x.shape[3] // self.P_W
 
-        # Create patches [B, C, H, W] -> [B, (H*W), C]
-        x_patch = rearrange(self.proj(x), "b d nh nw -> b (nh nw) d")
+        # The non-overlapping patch convolution is a single GEMM with the flattened kernel,
+        # followed by the positional embedding add
+        x_patch = patchify(x, self.P_H, self.P_W)
+        x_patch = F.linear(x_patch, self.proj.weight.flatten(1), self.proj.bias)
 
         # Create positional embedding
-        x_pos_emb = F.interpolate(
-            self.pos_emb, size=(N_H, N_W), mode="bicubic", align_corners=False
-        )
-        x_pos_emb = rearrange(x_pos_emb, "b d nh nw -> b (nh nw) d")
+        x_pos_emb = self.get_pos_emb(N_H, N_W)
 
         # Add patches and positional embeddings
         x = x_patch + x_pos_emb
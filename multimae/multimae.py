@@ -17,17 +17,18 @@
 import itertools
 import math
 from collections import OrderedDict
+from contextlib import nullcontext
 from functools import partial
 from typing import Dict, List, Optional, Tuple, Union
 
 import torch
-from einops import repeat
 from torch import Tensor, nn
 from torch.distributions.dirichlet import Dirichlet
+from torch.utils.checkpoint import checkpoint
 
 from utils.registry import register_model
 
-from .multimae_utils import Block, trunc_normal_
+from .multimae_utils import Block, compile_forward, trunc_normal_
 from .output_adapters import SpatialOutputAdapter
 from .input_adapters import PatchedInputAdapter
 
@@ -59,6 +60,13 @@ class MultiMAE(nn.Module):
     :param attn_drop_rate: Attention matrix drop rate
     :param drop_path_rate: DropPath drop rate
     :param norm_layer: Type of normalization layer
+    :param act_layer: Type of activation layer in the encoder MLPs. Pretrained weights
+        use the exact GELU, partial(nn.GELU, approximate="tanh") is faster.
+    :param compile_encoder: Set to True to compile the transformer encoder with torch.compile (CUDA only)
+    :param encoder_amp_dtype: Optional dtype (e.g. torch.bfloat16) to run the transformer encoder
+        in with autocast. Input adapters and the residual stream stay in full precision.
+    :param use_checkpoint: Set to True to use activation checkpointing over pairs of encoder
+        blocks during training, trading recomputation for memory
     """
 
     def __init__(
@@ -75,6 +83,10 @@ class MultiMAE(nn.Module):
         attn_drop_rate: float = 0.0,
         drop_path_rate: float = 0.0,
         norm_layer: nn.Module = partial(nn.LayerNorm, eps=1e-6),
+        act_layer: nn.Module = nn.GELU,
+        compile_encoder: bool = False,
+        encoder_amp_dtype: Optional[torch.dtype] = None,
+        use_checkpoint: bool = False,
     ):
         super().__init__()
 
@@ -95,9 +107,10 @@ class MultiMAE(nn.Module):
         trunc_normal_(self.global_tokens, std=0.02)
 
         # Transformer encoder
-        dpr = [
-            x.item() for x in torch.linspace(0, drop_path_rate, depth)
-        ]  # stochastic depth decay rule
+        self.encoder_amp_dtype = encoder_amp_dtype
+        self.use_checkpoint = use_checkpoint
+        # stochastic depth decay rule
+        dpr = torch.linspace(0, drop_path_rate, depth).tolist()
         self.encoder = nn.Sequential(
             *[
                 Block(
@@ -108,42 +121,66 @@ class MultiMAE(nn.Module):
                     drop=drop_rate,
                     attn_drop=attn_drop_rate,
                     drop_path=dpr[i],
+                    act_layer=act_layer,
                     norm_layer=norm_layer,
                 )
                 for i in range(depth)
             ]
         )
 
-        self.apply(self._init_weights)
-        for name, m in self.named_modules():
-            if isinstance(m, nn.Linear):
-                if "qkv" in name:
-                    # treat the weights of Q, K, V separately
-                    val = math.sqrt(
-                        6.0 / float(m.weight.shape[0] // 3 + m.weight.shape[1])
-                    )
-                    nn.init.uniform_(m.weight, -val, val)
-                elif "kv" in name:
-                    # treat the weights of K, V separately
-                    val = math.sqrt(
-                        6.0 / float(m.weight.shape[0] // 2 + m.weight.shape[1])
-                    )
-                    nn.init.uniform_(m.weight, -val, val)
-
-            if isinstance(m, nn.Conv2d):
-                if ".proj" in name:
-                    # From MAE, initialize projection like nn.Linear (instead of nn.Conv2d)
-                    w = m.weight.data
-                    nn.init.xavier_uniform_(w.view([w.shape[0], -1]))
-
-    def _init_weights(self, m: nn.Module) -> None:
+        # Single pass over all modules, every weight is initialized exactly once
+        with torch.no_grad():
+            for name, m in self.named_modules():
+                self._init_weights(m, name)
+
+        if compile_encoder and torch.cuda.is_available():
+            # Fuse the pointwise ops of the blocks and replay them as a CUDA graph.
+            # Only forward is compiled so that the state dict keys stay unchanged
+            compile_forward(
+                self.encoder, mode="reduce-overhead", fullgraph=False, dynamic=False
+            )
+
+    def _init_weights(self, m: nn.Module, name: str = "") -> None:
         if isinstance(m, nn.Linear):
-            nn.init.xavier_uniform_(m.weight)
-            if isinstance(m, nn.Linear) and m.bias is not None:
+            if "qkv" in name:
+                # treat the weights of Q, K, V separately
+                val = math.sqrt(6.0 / float(m.weight.shape[0] // 3 + m.weight.shape[1]))
+                nn.init.uniform_(m.weight, -val, val)
+            elif "kv" in name:
+                # treat the weights of K, V separately
+                val = math.sqrt(6.0 / float(m.weight.shape[0] // 2 + m.weight.shape[1]))
+                nn.init.uniform_(m.weight, -val, val)
+            else:
+                nn.init.xavier_uniform_(m.weight)
+            if m.bias is not None:
                 nn.init.constant_(m.bias, 0)
         elif isinstance(m, nn.LayerNorm):
             nn.init.constant_(m.bias, 0)
             nn.init.constant_(m.weight, 1.0)
+        elif isinstance(m, nn.Conv2d) and ".proj" in name:
+            # From MAE, initialize projection like nn.Linear (instead of nn.Conv2d)
+            w = m.weight.data
+            nn.init.xavier_uniform_(w.view([w.shape[0], -1]))
+
+    def encoder_autocast(self, x: Tensor):
+        """Autocast context for the transformer encoder, a no-op if encoder_amp_dtype is not set."""
+        if self.encoder_amp_dtype is None:
+            return nullcontext()
+        return torch.autocast(device_type=x.device.type, dtype=self.encoder_amp_dtype)
+
+    def forward_encoder(self, x: Tensor) -> Tensor:
+        """
+        Forward pass through the transformer encoder.
+        When training with use_checkpoint, every pair of blocks is checkpointed: only its
+        input is kept and its activations are recomputed in the backward pass.
+
+        :param x: Input tokens
+        """
+        if self.use_checkpoint and self.training and torch.is_grad_enabled():
+            for i in range(0, len(self.encoder), 2):
+                x = checkpoint(self.encoder[i : i + 2], x, use_reentrant=False)
+            return x
+        return self.encoder(x)
 
     # def get_num_layers(self):
     #     return len(self.encoder)
@@ -402,11 +439,12 @@ class MultiMAE(nn.Module):
         )
 
         # Add global tokens to input tokens
-        global_tokens = repeat(self.global_tokens, "() n d -> b n d", b=B)
+        global_tokens = self.global_tokens.expand(B, -1, -1)
         input_tokens = torch.cat([input_tokens, global_tokens], dim=1)
 
         ## Transformer forward pass
-        encoder_tokens = self.encoder(input_tokens)
+        with self.encoder_autocast(input_tokens):
+            encoder_tokens = self.forward_encoder(input_tokens)
 
         ## Output decoders
         if self.output_adapters is None:
@@ -442,6 +480,7 @@ class MultiMAE(nn.Module):
 def pretrain_multimae_base(
     input_adapters: Dict[str, nn.Module],
     output_adapters: Optional[Dict[str, nn.Module]],
+    norm_layer: nn.Module = partial(nn.LayerNorm, eps=1e-6),
     **kwargs,
 ):
     model = MultiMAE(
@@ -452,7 +491,7 @@ def pretrain_multimae_base(
         num_heads=12,
         mlp_ratio=4,
         qkv_bias=True,
-        norm_layer=partial(nn.LayerNorm, eps=1e-6),
+        norm_layer=norm_layer,
         **kwargs,
     )
     return model
@@ -462,6 +501,7 @@ def pretrain_multimae_base(
 def pretrain_multimae_large(
     input_adapters: Dict[str, nn.Module],
     output_adapters: Optional[Dict[str, nn.Module]],
+    norm_layer: nn.Module = partial(nn.LayerNorm, eps=1e-6),
     **kwargs,
 ):
     model = MultiMAE(
@@ -472,7 +512,7 @@ def pretrain_multimae_large(
         num_heads=16,
         mlp_ratio=4,
         qkv_bias=True,
-        norm_layer=partial(nn.LayerNorm, eps=1e-6),
+        norm_layer=norm_layer,
         **kwargs,
     )
     return model
@@ -496,6 +536,13 @@ class MultiViT(MultiMAE):
     :param attn_drop_rate: Attention matrix drop rate
     :param drop_path_rate: DropPath drop rate
     :param norm_layer: Type of normalization layer
+    :param act_layer: Type of activation layer in the encoder MLPs. Pretrained weights
+        use the exact GELU, partial(nn.GELU, approximate="tanh") is faster.
+    :param compile_encoder: Set to True to compile the transformer encoder with torch.compile (CUDA only)
+    :param encoder_amp_dtype: Optional dtype (e.g. torch.bfloat16) to run the transformer encoder
+        in with autocast. Input adapters and the residual stream stay in full precision.
+    :param use_checkpoint: Set to True to use activation checkpointing over pairs of encoder
+        blocks during training, trading recomputation for memory
     """
 
     def process_input(self, x):
@@ -523,52 +570,75 @@ class MultiViT(MultiMAE):
         input_info = self.generate_input_info(
             input_task_tokens=input_task_tokens, image_size=(H, W)
         )
-        input_tokens = torch.cat(
-            [task_tokens for task_tokens in input_task_tokens.values()], dim=1
-        )
 
-        # Add global tokens to input tokens
-        global_tokens = repeat(self.global_tokens, "() n d -> b n d", b=B)
-        input_tokens = torch.cat([input_tokens, global_tokens], dim=1)
+        # Concatenate task tokens and global tokens in a single allocation + copy
+        global_tokens = self.global_tokens.expand(B, -1, -1)
+        input_tokens = torch.cat([*input_task_tokens.values(), global_tokens], dim=1)
 
         return input_tokens, input_info
 
-    def forward(
-        self,
-        x: Union[Dict[str, torch.Tensor], torch.Tensor],
-        return_all_layers=False,
-        **kwargs,
-    ):
+    def forward(self, x: Union[Dict[str, torch.Tensor], torch.Tensor], **kwargs):
         """
         Forward pass through input adapters, transformer encoder and output adapters.
+        Use forward_all_layers to get the tokens of every transformer layer.
 
         :param x: Input tensor or dictionary of tensors
-        :param return_all_layers: Set to True to return all transformer layers
         """
+        if "return_all_layers" in kwargs:
+            raise TypeError(
+                "MultiViT.forward no longer takes return_all_layers, "
+                "use MultiViT.forward_all_layers(x) to get every transformer layer"
+            )
 
         input_tokens, input_info = self.process_input(x)
 
         # Pass tokens through Transformer
-        if not return_all_layers:
-            encoder_tokens = self.encoder(input_tokens)
-        else:
-            # Optionally access every intermediate layer
-            encoder_tokens = []
+        with self.encoder_autocast(input_tokens):
+            encoder_tokens = self.forward_encoder(input_tokens)
+
+        return self.forward_output_adapters(encoder_tokens, input_info)
+
+    def forward_all_layers(self, x: Union[Dict[str, torch.Tensor], torch.Tensor]):
+        """
+        Forward pass like forward, but passes the tokens of every transformer layer
+        to the output adapters (e.g. for DPT), or returns them if there are none.
+
+        :param x: Input tensor or dictionary of tensors
+        """
+
+        input_tokens, input_info = self.process_input(x)
+
+        # Access every intermediate layer
+        encoder_tokens = []
+        with self.encoder_autocast(input_tokens):
             tokens = input_tokens
             for block in self.encoder:
                 tokens = block(tokens)
                 encoder_tokens.append(tokens)
 
+        return self.forward_output_adapters(encoder_tokens, input_info)
+
+    def forward_output_adapters(self, encoder_tokens, input_info):
         if self.output_adapters is None:
             return encoder_tokens
 
+        # Common single-task case (e.g. only semseg). Looked up per call rather than cached,
+        # so that output adapters replaced after construction are picked up.
+        if len(self.output_adapters) == 1:
+            domain, output_adapter = next(iter(self.output_adapters.items()))
+            return {
+                domain: output_adapter(
+                    encoder_tokens=encoder_tokens, input_info=input_info
+                )
+            }
+
         # Decode tokens for each task using task-specific output adapters
         preds = {
-            domain: self.output_adapters[domain](
+            domain: output_adapter(
                 encoder_tokens=encoder_tokens,
                 input_info=input_info,
             )
-            for domain in self.output_adapters
+            for domain, output_adapter in self.output_adapters.items()
         }
 
         return preds
@@ -578,6 +648,7 @@ class MultiViT(MultiMAE):
 def multivit_base(
     input_adapters: Dict[str, nn.Module],
     output_adapters: Optional[Dict[str, nn.Module]],
+    norm_layer: nn.Module = partial(nn.LayerNorm, eps=1e-6),
     **kwargs,
 ):
     model = MultiViT(
@@ -588,7 +659,7 @@ def multivit_base(
         num_heads=12,
         mlp_ratio=4,
         qkv_bias=True,
-        norm_layer=partial(nn.LayerNorm, eps=1e-6),
+        norm_layer=norm_layer,
         **kwargs,
     )
     return model
@@ -598,6 +669,7 @@ def multivit_base(
 def multivit_large(
     input_adapters: Dict[str, nn.Module],
     output_adapters: Optional[Dict[str, nn.Module]],
+    norm_layer: nn.Module = partial(nn.LayerNorm, eps=1e-6),
     **kwargs,
 ):
     model = MultiViT(
@@ -608,7 +680,7 @@ def multivit_large(
         num_heads=16,
         mlp_ratio=4,
         qkv_bias=True,
-        norm_layer=partial(nn.LayerNorm, eps=1e-6),
+        norm_layer=norm_layer,
         **kwargs,
     )
     return model
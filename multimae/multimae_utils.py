@@ -15,12 +15,34 @@
 # --------------------------------------------------------
 
 import math
+import types
 import warnings
+from functools import lru_cache
 
 import torch
-from einops import rearrange
+import torch.nn.functional as F
 from torch import Tensor, nn
 
+try:
+    # Optional: fused attention directly on the packed [B, N, 3, heads, head_dim] qkv tensor
+    from flash_attn import flash_attn_qkvpacked_func
+except ImportError:
+    flash_attn_qkvpacked_func = None
+
+try:
+    # Optional: apex fused LayerNorm, opt-in as norm_layer. FusedLayerNorm only imports its
+    # CUDA extension when constructed, so check that apex was built with it.
+    import fused_layer_norm_cuda  # noqa: F401
+    from apex.normalization import FusedLayerNorm
+except ImportError:
+    FusedLayerNorm = None
+
+
+@lru_cache(maxsize=None)
+def _flash_attn_supported(device_index: int) -> bool:
+    # flash-attn 2 kernels only run on Ampere (sm80) and newer GPUs
+    return torch.cuda.get_device_capability(device_index) >= (8, 0)
+
 
 def pair(t):
     return t if isinstance(t, tuple) else (t, t)
@@ -33,20 +55,23 @@ def build_2d_sincos_posemb(h, w, embed_dim=1024, temperature=10000.0):
     """
     grid_w = torch.arange(w, dtype=torch.float32)
     grid_h = torch.arange(h, dtype=torch.float32)
-    grid_w, grid_h = torch.meshgrid(grid_w, grid_h)
     assert (
         embed_dim % 4 == 0
     ), "Embed dimension must be divisible by 4 for 2D sin-cos position embedding"
     pos_dim = embed_dim // 4
     omega = torch.arange(pos_dim, dtype=torch.float32) / pos_dim
     omega = 1.0 / (temperature**omega)
-    out_w = torch.einsum("m,d->md", [grid_w.flatten(), omega])
-    out_h = torch.einsum("m,d->md", [grid_h.flatten(), omega])
-    pos_emb = torch.cat(
-        [torch.sin(out_w), torch.cos(out_w), torch.sin(out_h), torch.cos(out_h)], dim=1
-    )[None, :, :]
-    pos_emb = rearrange(pos_emb, "b (h w) d -> b d h w", h=h, w=w, d=embed_dim)
-    return pos_emb
+    out_w = torch.outer(omega, grid_w)  # [pos_dim, w]
+    out_h = torch.outer(omega, grid_h)  # [pos_dim, h]
+    # Fill the four channel slabs in place, broadcasting over the other grid axis instead of
+    # building a meshgrid. The [D, w, h] layout keeps the flattened order of the original
+    # meshgrid(grid_w, grid_h) implementation, so the result is viewed as [1, D, h, w] as before.
+    pos_emb = torch.empty(embed_dim, w, h)
+    pos_emb[0 * pos_dim : 1 * pos_dim] = torch.sin(out_w)[:, :, None]
+    pos_emb[1 * pos_dim : 2 * pos_dim] = torch.cos(out_w)[:, :, None]
+    pos_emb[2 * pos_dim : 3 * pos_dim] = torch.sin(out_h)[:, None, :]
+    pos_emb[3 * pos_dim : 4 * pos_dim] = torch.cos(out_h)[:, None, :]
+    return pos_emb.view(1, embed_dim, h, w)
 
 
 def _no_grad_trunc_normal_(tensor, mean, std, a, b):
@@ -122,10 +147,40 @@ def drop_path(x, drop_prob: float = 0.0, training: bool = False):
     shape = (x.shape[0],) + (1,) * (
         x.ndim - 1
     )  # work with diff dim tensors, not just 2D ConvNets
-    random_tensor = keep_prob + torch.rand(shape, dtype=x.dtype, device=x.device)
-    random_tensor.floor_()  # binarize
-    output = x.div(keep_prob) * random_tensor
-    return output
+    # Binary keep mask pre-scaled by 1 / keep_prob, so x is only touched by a single multiply
+    random_tensor = x.new_empty(shape).bernoulli_(keep_prob).div_(keep_prob)
+    return x * random_tensor
+
+
+def compile_forward(module: nn.Module, **compile_kwargs) -> nn.Module:
+    """
+    Compiles the forward of a module with torch.compile, in place.
+    Unlike torch.compile(module), parameter names and state dict keys stay unchanged.
+    The unbound forward is compiled and bound as a method, so that copies of the module
+    (e.g. copy.deepcopy for model EMA) run with their own weights, getting their own graph.
+
+    :param module: Module to compile
+    :param compile_kwargs: Keyword arguments for torch.compile
+    """
+    module.forward = types.MethodType(
+        torch.compile(type(module).forward, **compile_kwargs), module
+    )
+    return module
+
+
+def scaled_dot_product_attention(
+    q: Tensor, k: Tensor, v: Tensor, dropout_p: float = 0.0
+) -> Tensor:
+    """
+    Fused attention (FlashAttention / memory-efficient kernels when available), scaled by
+    head_dim**-0.5. Never materializes the N x M attention matrix.
+    Falls back to the explicit softmax(q @ k^T * scale) @ v when exporting to ONNX, since
+    F.scaled_dot_product_attention has no ONNX export before torch 2.1.
+    """
+    if torch.onnx.is_in_onnx_export():
+        attn = (q @ k.transpose(-2, -1)) * q.shape[-1] ** -0.5
+        return attn.softmax(dim=-1) @ v
+    return F.scaled_dot_product_attention(q, k, v, dropout_p=dropout_p, is_causal=False)
 
 
 class DropPath(nn.Module):
@@ -136,6 +191,8 @@ class DropPath(nn.Module):
         self.drop_prob = drop_prob
 
     def forward(self, x):
+        if not self.training or not self.drop_prob:
+            return x
         return drop_path(x, self.drop_prob, self.training)
 
     def extra_repr(self) -> str:
@@ -180,8 +237,6 @@ class Attention(nn.Module):
     ):
         super().__init__()
         self.num_heads = num_heads
-        head_dim = dim // num_heads
-        self.scale = head_dim**-0.5
 
         self.qkv = nn.Linear(dim, dim * 3, bias=qkv_bias)
         self.attn_drop = nn.Dropout(attn_drop)
@@ -190,18 +245,28 @@ class Attention(nn.Module):
 
     def forward(self, x):
         B, N, C = x.shape
-        qkv = (
-            self.qkv(x)
-            .reshape(B, N, 3, self.num_heads, C // self.num_heads)
-            .permute(2, 0, 3, 1, 4)
-        )
-        q, k, v = qkv.unbind(0)  # make torchscript happy (cannot use tensor as tuple)
-
-        attn = (q @ k.transpose(-2, -1)) * self.scale
-        attn = attn.softmax(dim=-1)
-        attn = self.attn_drop(attn)
+        dropout_p = self.attn_drop.p if self.training else 0.0
+        # [B, N, 3, heads, head_dim]
+        qkv = self.qkv(x).unflatten(-1, (3, self.num_heads, -1))
+
+        if (
+            flash_attn_qkvpacked_func is not None
+            and not torch.jit.is_tracing()
+            and qkv.is_cuda
+            and qkv.dtype in (torch.float16, torch.bfloat16)
+            and _flash_attn_supported(qkv.device.index)
+        ):
+            # Single kernel on the packed Linear output, returns [B, N, heads, head_dim]
+            x = flash_attn_qkvpacked_func(qkv, dropout_p=dropout_p)
+            x = x.reshape(B, N, C)
+        else:
+            # [B, N, 3, heads, head_dim] -> [3, B, heads, N, head_dim] as pure views;
+            # SDPA accepts the strided q/k/v directly, so no activation-sized copy is made.
+            q, k, v = qkv.permute(2, 0, 3, 1, 4).unbind(0)
+
+            x = scaled_dot_product_attention(q, k, v, dropout_p=dropout_p)
+            x = x.transpose(1, 2).reshape(B, N, C)
 
-        x = (attn @ v).transpose(1, 2).reshape(B, N, C)
         x = self.proj(x)
         x = self.proj_drop(x)
         return x
@@ -211,8 +276,6 @@ class CrossAttention(nn.Module):
     def __init__(self, dim, num_heads=8, qkv_bias=False, attn_drop=0.0, proj_drop=0.0):
         super().__init__()
         self.num_heads = num_heads
-        head_dim = dim // num_heads
-        self.scale = head_dim**-0.5
 
         self.q = nn.Linear(dim, dim, bias=qkv_bias)
         self.kv = nn.Linear(dim, dim * 2, bias=qkv_bias)
@@ -223,25 +286,19 @@ class CrossAttention(nn.Module):
 
     def forward(self, x: Tensor, context: Tensor):
         B, N, C = x.shape
-        _, M, _ = context.shape
+        dropout_p = self.attn_drop.p if self.training else 0.0
 
-        q = (
-            self.q(x)
-            .reshape(B, N, self.num_heads, C // self.num_heads)
-            .permute(0, 2, 1, 3)
-        )
-        kv = (
+        q = self.q(x).unflatten(-1, (self.num_heads, -1)).transpose(1, 2)
+        k, v = (
             self.kv(context)
-            .reshape(B, M, 2, self.num_heads, C // self.num_heads)
+            .unflatten(-1, (2, self.num_heads, -1))
             .permute(2, 0, 3, 1, 4)
+            .unbind(0)
         )
-        k, v = kv[0], kv[1]
-
-        attn = (q @ k.transpose(-2, -1)) * self.scale
-        attn = attn.softmax(dim=-1)
-        attn = self.attn_drop(attn)
 
-        x = (attn @ v).transpose(1, 2).reshape(B, N, -1)
+        # Attention of the queries over the context tokens
+        x = scaled_dot_product_attention(q, k, v, dropout_p=dropout_p)
+        x = x.transpose(1, 2).reshape(B, N, C)
         x = self.proj(x)
         x = self.proj_drop(x)
         return x
@@ -20,17 +20,21 @@ class ConvNeXtBlock(nn.Module):
     r"""ConvNeXt Block. There are two equivalent implementations:
     (1) DwConv -> LayerNorm (channels_first) -> 1x1 Conv -> GELU -> 1x1 Conv; all in (N, C, H, W)
     (2) DwConv -> Permute to (N, H, W, C); LayerNorm (channels_last) -> Linear -> GELU -> Linear; Permute back
-    We use (2) as we find it slightly faster in PyTorch
+    We use (2) as we find it slightly faster in PyTorch.
+    Inputs are expected in channels_last memory format, which makes both permutes free views.
 
     Args:
         dim (int): Number of input channels.
         drop_path: Stochastic depth rate. Default: 0.0
+        act_layer: Type of activation layer. Default: nn.GELU
         layer_scale_init_value (float): Init value for Layer Scale. Default: 0 (disabled for isotropic ConvNeXt).
 
     Code from: https://github.com/facebookresearch/ConvNeXt/blob/main/models/convnext.py
     """
 
-    def __init__(self, dim, drop_path=0.0, layer_scale_init_value=0.0):
+    def __init__(
+        self, dim, drop_path=0.0, layer_scale_init_value=0.0, act_layer=nn.GELU
+    ):
         super().__init__()
         self.dwconv = nn.Conv2d(
             dim, dim, kernel_size=7, padding=3, groups=dim
@@ -39,7 +43,7 @@ class ConvNeXtBlock(nn.Module):
         self.pwconv1 = nn.Linear(
             dim, 4 * dim
         )  # pointwise/1x1 convs, implemented with linear layers
-        self.act = nn.GELU()
+        self.act = act_layer()
         self.pwconv2 = nn.Linear(4 * dim, dim)
         self.gamma = (
             nn.Parameter(layer_scale_init_value * torch.ones((dim)), requires_grad=True)
@@ -51,7 +55,8 @@ class ConvNeXtBlock(nn.Module):
     def forward(self, x):
         input = x
         x = self.dwconv(x)
-        x = x.permute(0, 2, 3, 1)  # (N, C, H, W) -> (N, H, W, C)
+        # (N, C, H, W) -> (N, H, W, C), no copy in channels_last
+        x = x.permute(0, 2, 3, 1)
         x = self.norm(x)
         x = self.pwconv1(x)
         x = self.act(x)
@@ -463,6 +463,7 @@ class ConvNeXtAdapter(nn.Module):
     :param patch_size: Size of patches
     :param depth: Number of ConvNeXt blocks
     :interpolate_mode: Interpolation mode for final upsampling
+    :param act_layer: Type of activation layer in the ConvNeXt blocks
     """
 
     def __init__(
@@ -474,6 +475,7 @@ class ConvNeXtAdapter(nn.Module):
         patch_size: int = 16,
         depth: int = 4,
         interpolate_mode: str = "bilinear",
+        act_layer: nn.Module = nn.GELU,
         **kwargs,
     ):
         super().__init__()
@@ -482,14 +484,28 @@ class ConvNeXtAdapter(nn.Module):
         self.embed_dim = embed_dim
         self.preds_per_patch = preds_per_patch
         self.class_dim = embed_dim // preds_per_patch
+        # Height / width of the sub-patch grid each token is reshaped into
+        self.ph = self.pw = int(preds_per_patch**0.5)
+        assert (
+            self.ph * self.pw == preds_per_patch
+        ), f"preds_per_patch must be a perfect square, got {preds_per_patch}"
+        assert (
+            embed_dim % preds_per_patch == 0
+        ), f"embed_dim {embed_dim} must be divisible by preds_per_patch {preds_per_patch}"
         self.num_classes = num_classes
         self.interpolate_mode = interpolate_mode
 
         self.blocks = nn.Sequential(
-            *[ConvNeXtBlock(dim=self.class_dim) for _ in range(depth)]
+            *[
+                ConvNeXtBlock(dim=self.class_dim, act_layer=act_layer)
+                for _ in range(depth)
+            ]
         )
         self.final_layer = nn.Conv2d(self.class_dim, self.num_classes, 1)
         self.apply(self._init_weights)
+        # Run the ConvNeXt blocks in NHWC: cuDNN uses its channels_last depthwise kernels
+        # and the permutes around LayerNorm / pointwise Linears become free
+        self.to(memory_format=torch.channels_last)
 
     def init(self, dim_tokens_enc: int = 768):
         """
@@ -515,14 +531,16 @@ class ConvNeXtAdapter(nn.Module):
 
     def adapt_tokens(self, encoder_tokens, input_info):
         # Adapt tokens
-        x = []
-        for task in self.main_tasks:
-            start_idx = input_info["tasks"][task]["start_idx"]
-            end_idx = input_info["tasks"][task]["end_idx"]
-            x.append(encoder_tokens[:, start_idx:end_idx])
+        tasks_info = input_info["tasks"]
+        x = [
+            encoder_tokens.narrow(
+                1, tasks_info[task]["start_idx"], tasks_info[task]["num_tokens"]
+            )
+            for task in self.main_tasks
+        ]
 
-        x = torch.cat(x, dim=-1)
-        return x
+        # A single task is returned as a view, cat would copy it
+        return x[0] if len(x) == 1 else torch.cat(x, dim=-1)
 
     def forward(self, encoder_tokens: Tensor, input_info: Dict[str, Tensor]):
         H, W = input_info["image_size"]
@@ -531,20 +549,14 @@ class ConvNeXtAdapter(nn.Module):
         x = self.adapt_tokens(encoder_tokens, input_info)
 
         x = self.proj_dec(x)
-        x = rearrange(
-            x,
-            "b n (p c) -> b (n p) c",
-            n=N_H * N_W,
-            p=self.preds_per_patch,
-            c=self.class_dim,
-        )
-        x = rearrange(
-            x,
-            "b (nh nw ph pw) c -> b c (nh ph) (nw pw)",
-            nh=N_H,
-            nw=N_W,
-            ph=int(self.preds_per_patch**0.5),
-            pw=int(self.preds_per_patch**0.5),
+        # b (nh nw) (ph pw c) -> b c (nh ph) (nw pw) with a single copy. The copy is laid out
+        # as b (nh ph) (nw pw) c, so the final permute gives a channels_last tensor for free.
+        B = x.shape[0]
+        x = (
+            x.view(B, N_H, N_W, self.ph, self.pw, self.class_dim)
+            .permute(0, 1, 3, 2, 4, 5)
+            .reshape(B, N_H * self.ph, N_W * self.pw, self.class_dim)
+            .permute(0, 3, 1, 2)
         )
         x = self.blocks(x)
         x = self.final_layer(x)
@@ -728,14 +740,16 @@ class DPTOutputAdapter(nn.Module):
 
     def adapt_tokens(self, encoder_tokens, input_info):
         # Adapt tokens
-        x = []
-        for task in self.main_tasks:
-            start_idx = input_info["tasks"][task]["start_idx"]
-            end_idx = input_info["tasks"][task]["end_idx"]
-            x.append(encoder_tokens[:, start_idx:end_idx])
+        tasks_info = input_info["tasks"]
+        x = [
+            encoder_tokens.narrow(
+                1, tasks_info[task]["start_idx"], tasks_info[task]["num_tokens"]
+            )
+            for task in self.main_tasks
+        ]
 
-        x = torch.cat(x, dim=-1)
-        return x
+        # A single task is returned as a view, cat would copy it
+        return x[0] if len(x) == 1 else torch.cat(x, dim=-1)
 
     def forward(self, encoder_tokens: List[Tensor], input_info: Dict):
         assert (
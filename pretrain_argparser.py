@@ -40,6 +40,13 @@ class PretrainArgparser(Tap):
     ] = 2  # Number of self-attention layers after the initial cross attention (default: %(default)s)
     decoder_num_heads: Optional[int] = 8
     drop_path: Optional[float] = 0.0
+    compile_encoder: Optional[bool] = False  # torch.compile the encoder blocks (CUDA only)
+    use_checkpoint: Optional[bool] = False  # Activation checkpointing in the encoder
+    encoder_amp_dtype: Optional[str] = None  # Autocast dtype of the encoder, e.g. bfloat16
+    tanh_gelu: Optional[bool] = False  # tanh GELU in the encoder, pretrained weights use exact GELU
+    fused_layer_norm: Optional[bool] = False  # apex FusedLayerNorm in the encoder (CUDA only)
+    compile_model: Optional[bool] = False  # torch.compile the whole model forward
+    compile_mode: Optional[str] = "max-autotune"  # torch.compile mode used by compile_model
     loss_on_unmasked: Optional[bool] = False
     embed_dim: Optional[int] = 6144
     input_patch_size: Optional[int] = 16
@@ -137,6 +144,14 @@ class PretrainArgparser(Tap):
     # Pytorch Lightning
     save_top_k: Optional[int] = 1
 
+    # Export (export_model.py)
+    export_trt: Optional[bool] = False  # Build a TensorRT FP16 engine from the exported ONNX model
+    use_trt: Optional[bool] = False  # Run the exported TensorRT engine on dummy inputs
+    quantize_fp8: Optional[bool] = False  # FP8 post-training quantization with NVIDIA ModelOpt
+    num_calib_samples: Optional[int] = 64  # Validation samples used for FP8 calibration
+    use_cuda_graph: Optional[bool] = False  # Time the model replayed as a CUDA graph
+    use_ort: Optional[bool] = False  # Optimize the ONNX model for ONNX Runtime on CPU and run it
+
     def todict(self):
         d = dict()
         for k, v in self.__dict__.items():
@@ -1,4 +1,3 @@
-from collections import OrderedDict
 import matplotlib.pyplot as plt
 import time
 from pytorch_lightning.loggers import WandbLogger
@@ -7,7 +6,10 @@ from logging import Logger
 from pathlib import Path
 from typing import Any, Dict, List, Optional, Tuple, Union
 
+import inspect
 import json
+import pickle
+import warnings
 import torch
 from torch import Tensor
 import os
@@ -106,13 +108,25 @@ class ModelPL(pl.LightningModule):
 
     def load_pretrained_weights(self):
         if self.args.pretrained_weights:
-            checkpoint: OrderedDict[str, Tensor] = torch.load(
-                self.args.pretrained_weights
-            )["model"]
+            load_kwargs = dict(map_location="cpu", weights_only=True)
+            # torch >= 2.1 can page tensors in lazily instead of reading the whole file
+            if "mmap" in inspect.signature(torch.load).parameters:
+                load_kwargs["mmap"] = True
+            try:
+                ckpt = torch.load(self.args.pretrained_weights, **load_kwargs)
+            except pickle.UnpicklingError:
+                # Checkpoints saved by utils.checkpoint.save_model also pickle the args
+                warnings.warn(
+                    f"{self.args.pretrained_weights} is not a plain state dict, "
+                    "loading it with weights_only=False"
+                )
+                load_kwargs["weights_only"] = False
+                ckpt = torch.load(self.args.pretrained_weights, **load_kwargs)
+            checkpoint: Dict[str, Tensor] = ckpt["model"]
             if self.args.input_size != 224:
-                for k in list(checkpoint.keys()):
-                    if k.endswith(".pos_emb"):
-                        del checkpoint[k]
+                checkpoint = {
+                    k: v for k, v in checkpoint.items() if not k.endswith(".pos_emb")
+                }
             self.model.load_state_dict(checkpoint, strict=False)
             print("Load pretrained weights from", self.args.pretrained_weights)
 
@@ -495,6 +509,10 @@ class DataPL(pl.LightningDataModule):
 
 
 def main(args: PretrainArgparser):
+    # Let fp32 matmuls (e.g. in fp32_output_adapters) use TF32 tensor cores on Ampere+ GPUs
+    torch.set_float32_matmul_precision("high")
+    torch.backends.cuda.matmul.allow_tf32 = True
+
     ckpt_path = os.path.join(args.output_dir, "last.ckpt")
     if not os.path.isfile(ckpt_path):
         shutil.rmtree(args.output_dir, ignore_errors=True)
@@ -0,0 +1,53 @@
+import pytest
+import torch
+import torch.nn.functional as F
+
+from multimae.output_adapters import ConvNeXtAdapter
+
+einops = pytest.importorskip("einops")
+
+
+def test_convnext_adapter_reshape_matches_rearrange():
+    torch.manual_seed(0)
+    patch_size, preds_per_patch, H, W = 4, 4, 24, 32
+    adapter = ConvNeXtAdapter(
+        num_classes=5,
+        embed_dim=64,
+        preds_per_patch=preds_per_patch,
+        patch_size=patch_size,
+        depth=1,
+    )
+    adapter.init(dim_tokens_enc=32)
+    adapter.eval()
+
+    N_H, N_W = H // patch_size, W // patch_size
+    encoder_tokens = torch.randn(2, N_H * N_W + 1, 32)
+    input_info = {
+        "image_size": (H, W),
+        "tasks": {"rgb": {"start_idx": 0, "num_tokens": N_H * N_W}},
+    }
+
+    with torch.no_grad():
+        out = adapter(encoder_tokens, input_info)
+
+        # Original chained rearranges
+        x = adapter.proj_dec(adapter.adapt_tokens(encoder_tokens, input_info))
+        x = einops.rearrange(
+            x,
+            "b n (p c) -> b (n p) c",
+            n=N_H * N_W,
+            p=preds_per_patch,
+            c=adapter.class_dim,
+        )
+        x = einops.rearrange(
+            x,
+            "b (nh nw ph pw) c -> b c (nh ph) (nw pw)",
+            nh=N_H,
+            nw=N_W,
+            ph=int(preds_per_patch**0.5),
+            pw=int(preds_per_patch**0.5),
+        )
+        x = adapter.final_layer(adapter.blocks(x))
+        reference = F.interpolate(x, size=(H, W), mode=adapter.interpolate_mode)
+
+    torch.testing.assert_close(out, reference, rtol=1e-5, atol=1e-5)
@@ -0,0 +1,103 @@
+import pytest
+import torch
+import torch.nn.functional as F
+
+from multimae.input_adapters import PatchedInputAdapter
+
+
+@pytest.mark.parametrize(
+    "num_channels, stride_level, image_size", [(3, 1, 64), (1, 1, 48), (3, 4, 64)]
+)
+def test_patch_embedding_matches_conv2d(num_channels, stride_level, image_size):
+    torch.manual_seed(0)
+    adapter = PatchedInputAdapter(
+        num_channels=num_channels,
+        stride_level=stride_level,
+        patch_size_full=16,
+        dim_tokens=32,
+        image_size=image_size,
+    )
+    size = image_size // stride_level
+    x = torch.randn(2, num_channels, size, size)
+
+    with torch.no_grad():
+        tokens = adapter(x)
+        # Patch convolution as in the original Conv2d implementation
+        reference = F.conv2d(
+            x, adapter.proj.weight, adapter.proj.bias, stride=adapter.proj.stride
+        )
+        reference = reference.flatten(2).transpose(1, 2)
+        reference = reference + adapter.pos_emb.flatten(2).transpose(1, 2)
+
+    torch.testing.assert_close(tokens, reference, rtol=1e-5, atol=1e-5)
+
+
+def test_patch_embedding_loads_linear_weight():
+    adapter = PatchedInputAdapter(
+        num_channels=3, stride_level=1, patch_size_full=16, dim_tokens=32, image_size=64
+    )
+    weight = torch.randn(32, 3 * 16 * 16)
+    adapter.load_state_dict({"proj.weight": weight}, strict=False)
+    torch.testing.assert_close(adapter.proj.weight.flatten(1), weight)
+
+
+def _patch_tokens(adapter: PatchedInputAdapter, x: torch.Tensor) -> torch.Tensor:
+    # Patch embedding without positional embeddings
+    x = F.conv2d(x, adapter.proj.weight, adapter.proj.bias, stride=adapter.proj.stride)
+    return x.flatten(2).transpose(1, 2)
+
+
+def test_pos_emb_cache_invalidated_by_load_state_dict():
+    torch.manual_seed(0)
+    adapter = PatchedInputAdapter(
+        num_channels=3, stride_level=1, patch_size_full=16, dim_tokens=32, image_size=64
+    )
+    x = torch.randn(2, 3, 64, 64)
+
+    with torch.no_grad():
+        before = adapter(x)
+        pos_emb = torch.randn_like(adapter.pos_emb)
+        adapter.load_state_dict({"pos_emb": pos_emb}, strict=False)
+        after = adapter(x)
+        reference = _patch_tokens(adapter, x) + pos_emb.flatten(2).transpose(1, 2)
+
+    assert not torch.allclose(before, after)
+    torch.testing.assert_close(after, reference, rtol=1e-5, atol=1e-5)
+
+
+def test_pos_emb_interpolated_for_other_resolution():
+    torch.manual_seed(0)
+    adapter = PatchedInputAdapter(
+        num_channels=3, stride_level=1, patch_size_full=16, dim_tokens=32, image_size=64
+    )
+
+    with torch.no_grad():
+        for size in (96, 64, 96):
+            x = torch.randn(2, 3, size, size)
+            tokens = adapter(x)
+            N = size // 16
+            pos_emb = F.interpolate(
+                adapter.pos_emb, size=(N, N), mode="bicubic", align_corners=False
+            )
+            reference = _patch_tokens(adapter, x) + pos_emb.flatten(2).transpose(1, 2)
+            torch.testing.assert_close(tokens, reference, rtol=1e-5, atol=1e-5)
+
+
+@pytest.mark.parametrize("sincos_pos_emb", [True, False])
+def test_learnable_pos_emb_gets_gradients(sincos_pos_emb):
+    torch.manual_seed(0)
+    adapter = PatchedInputAdapter(
+        num_channels=3,
+        stride_level=1,
+        patch_size_full=16,
+        dim_tokens=32,
+        sincos_pos_emb=sincos_pos_emb,
+        learnable_pos_emb=True,
+        image_size=64,
+    )
+
+    for size in (64, 96):
+        adapter.zero_grad()
+        adapter(torch.randn(2, 3, size, size)).sum().backward()
+        assert adapter.pos_emb.grad is not None
+        assert adapter.pos_emb.grad.abs().sum() > 0
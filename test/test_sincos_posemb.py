@@ -0,0 +1,30 @@
+import pytest
+import torch
+
+from multimae.multimae_utils import build_2d_sincos_posemb
+
+einops = pytest.importorskip("einops")
+
+
+def build_2d_sincos_posemb_reference(h, w, embed_dim=1024, temperature=10000.0):
+    """Original meshgrid + einsum implementation from MoCo-v3"""
+    grid_w = torch.arange(w, dtype=torch.float32)
+    grid_h = torch.arange(h, dtype=torch.float32)
+    grid_w, grid_h = torch.meshgrid(grid_w, grid_h)
+    pos_dim = embed_dim // 4
+    omega = torch.arange(pos_dim, dtype=torch.float32) / pos_dim
+    omega = 1.0 / (temperature**omega)
+    out_w = torch.einsum("m,d->md", [grid_w.flatten(), omega])
+    out_h = torch.einsum("m,d->md", [grid_h.flatten(), omega])
+    pos_emb = torch.cat(
+        [torch.sin(out_w), torch.cos(out_w), torch.sin(out_h), torch.cos(out_h)], dim=1
+    )[None, :, :]
+    return einops.rearrange(pos_emb, "b (h w) d -> b d h w", h=h, w=w, d=embed_dim)
+
+
+@pytest.mark.parametrize("h, w", [(14, 14), (22, 22), (12, 20)])
+def test_build_2d_sincos_posemb_matches_reference(h, w):
+    pos_emb = build_2d_sincos_posemb(h, w, embed_dim=64)
+    reference = build_2d_sincos_posemb_reference(h, w, embed_dim=64)
+    assert pos_emb.shape == (1, 64, h, w)
+    torch.testing.assert_close(pos_emb, reference, rtol=0, atol=0)